@@ -19,15 +19,23 @@ Typical usage example:
     # it also supports dictionary style API too:
     disk["hamlet"] = "shakespeare"
 """
+import array
+import bisect
 import json
 import logging
+import mmap
 import os.path
+import sys
+import time
 import typing
-import datetime
-from dataclasses import dataclass
-from sortedcontainers import SortedDict  # type: ignore
 
-from format import encode_kv, decode_kv, decode_header, HEADER_SIZE
+from format import (
+    encode_kv_into,
+    encode_tombstone,
+    decode_kv,
+    decode_records,
+    HEADER_SIZE,
+)
 
 # DiskStorage is a Log-Structured Hash Table as described in the BitCask paper. We
 # keep appending the data to a file, like a log. DiskStorage maintains an in-memory
@@ -58,13 +66,40 @@ from format import encode_kv, decode_kv, decode_header, HEADER_SIZE
 
 logger = logging.getLogger(__name__)
 
+# Data files are scanned sequentially in chunks of this size
+READ_CHUNK_SIZE = 4 * 1024 * 1024
 
-@dataclass(frozen=True)
-class KeyDirEntry:
-    file_id: int
-    size: int
-    pos: int
-    tstamp: int
+# Writes to the active file are buffered and flushed in chunks of this size
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Modes of syncing written data to the disk
+Durability = typing.Literal["none", "batch", "per_write"]
+
+
+def _sync(fd: typing.BinaryIO) -> None:
+    """Sync file contents to the disk"""
+    if hasattr(os, "fdatasync"):
+        # file metadata besides size is not needed
+        os.fdatasync(fd.fileno())
+    else:
+        os.fsync(fd.fileno())
+
+
+def _sync_dir(path: str) -> None:
+    """Sync directory entries, such as created or renamed files, to the disk"""
+    # directories cannot be opened for syncing everywhere
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    dir_fd = os.open(path or ".", os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+# Location of the latest record of a key: file id, key and value size, position
+# in the file and timestamp
+KeyDirEntry = tuple[int, int, int, int]
 
 
 class KeyDir:
@@ -72,47 +107,98 @@ class KeyDir:
 
     Stores all the keys.
     Allow quick traversal
+
+    Entries are not kept as objects. Their fields are stored in parallel arrays
+    at the index assigned to the key, KeyDirEntry tuples are built only on access.
     """
 
     def __init__(self) -> None:
-        # RedBlack Tree-like structure
-        self._dir = SortedDict()
+        # key to index in the arrays below
+        self._dir: dict[str, int] = {}
+        self._file_ids = array.array("I")
+        self._sizes = array.array("Q")
+        self._positions = array.array("Q")
+        self._tstamps = array.array("I")
+
+        # Indices released by deleted keys
+        self._free: list[int] = []
+
+        # Sorted keys for range scans, built lazily and dropped when a key
+        # is added or removed
+        self._sorted_keys: list[str] | None = None
+
+    def _entry(self, idx: int) -> KeyDirEntry:
+        return (
+            self._file_ids[idx],
+            self._sizes[idx],
+            self._positions[idx],
+            self._tstamps[idx],
+        )
 
     def get(self, key: str) -> KeyDirEntry | None:
-        return self._dir.get(key)  # type: ignore
-
-    def set(self, key: str, entry: KeyDirEntry) -> None:
-        self._dir[key] = entry
+        idx = self._dir.get(key)
+        if idx is None:
+            return None
+        return self._entry(idx)
+
+    def set(self, key: str, file_id: int, size: int, pos: int, tstamp: int) -> None:
+        idx = self._dir.get(key)
+        if idx is None:
+            self._sorted_keys = None
+            if self._free:
+                idx = self._free.pop()
+            else:
+                idx = len(self._file_ids)
+                self._file_ids.append(0)
+                self._sizes.append(0)
+                self._positions.append(0)
+                self._tstamps.append(0)
+            self._dir[key] = idx
+        self._file_ids[idx] = file_id
+        self._sizes[idx] = size
+        self._positions[idx] = pos
+        self._tstamps[idx] = tstamp
 
     def delete(self, key: str) -> None:
         if key in self._dir:
-            del self._dir[key]
+            self._free.append(self._dir.pop(key))
+            self._sorted_keys = None
 
     def range(self, start: str, end: str) -> typing.Iterable[str]:
-        keys = self._dir.keys()
-        start_idx = self._dir.bisect_left(start)
-        if start_idx == len(self._dir):
-            return
-        for idx in range(start_idx, len(self._dir)):
-            # noinspection PyUnresolvedReferences
+        if self._sorted_keys is None:
+            self._sorted_keys = sorted(self._dir)
+        keys = self._sorted_keys
+        for idx in range(bisect.bisect_left(keys, start), len(keys)):
             key = keys[idx]
             if key <= end:
                 yield key
             else:
                 break
 
+    def __contains__(self, key: str) -> bool:
+        return key in self._dir
+
     def keys(self) -> typing.Iterable[str]:
-        return self._dir.keys()  # type: ignore
+        return self._dir.keys()
+
+    def items(self) -> typing.Iterable[tuple[str, KeyDirEntry]]:
+        for key, idx in self._dir.items():
+            yield key, self._entry(idx)
 
 
 class Registry:
     """Represents mapping from file id to file path.
 
-    Stored in JSON file in database directory.
+    Stored in database directory as a text file with a tab-separated file id and
+    file name per line. Registries in the former JSON format are still read.
+
+    With `durable` the registry is saved to a temporary file which is synced and
+    renamed over it, so a crash leaves either the old or the new registry.
     """
 
-    def __init__(self, registry_name: str):
+    def __init__(self, registry_name: str, durable: bool = False):
         self._registry_name = registry_name
+        self._durable = durable
 
         self._registry: dict[int, str] = dict()
 
@@ -120,20 +206,34 @@ class Registry:
             logger.info("Open existing registry {}".format(self._registry_name))
 
             with open(registry_name, "rt") as f:
-                deserialized = json.load(f)
-                self._registry = {
-                    int(file_id_str): content
-                    for file_id_str, content in deserialized.items()
-                }
+                content = f.read()
+            if content.startswith("{"):
+                deserialized = json.loads(content)
+            else:
+                deserialized = dict(line.split("\t") for line in content.splitlines())
+            self._registry = {
+                int(file_id_str): data_file
+                for file_id_str, data_file in deserialized.items()
+            }
         logger.info(f"Registry of {len(self._registry)} elements")
 
     def save(self) -> None:
         """Saves metadata to file"""
-        with open(self._registry_name, "wt") as f:
-            serialized = {
-                str(file_id): content for file_id, content in self._registry.items()
-            }
-            json.dump(serialized, f, indent=True)
+        content = "".join(
+            f"{file_id}\t{data_file}\n" for file_id, data_file in self._registry.items()
+        )
+        if not self._durable:
+            with open(self._registry_name, "wt") as f:
+                f.write(content)
+            return
+
+        tmp_name = self._registry_name + ".tmp"
+        with open(tmp_name, "wt") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, self._registry_name)
+        _sync_dir(os.path.dirname(self._registry_name))
 
     def empty(self) -> bool:
         return not self._registry
@@ -151,6 +251,10 @@ class Registry:
         data_path = os.path.join(os.path.dirname(self._registry_name), data_file)
         return data_path
 
+    def segment_size(self, file_id: int) -> int:
+        """Return size of file `file_id` on disk"""
+        return os.path.getsize(self.data_path(file_id))
+
     def active_file_id(self) -> int:
         """Return active file id"""
         if not self._registry:
@@ -183,43 +287,111 @@ class Registry:
 
 
 class FileDescriptors:
-    """Represents file desscriptor table."""
+    """Represents file desscriptor table.
 
-    def __init__(self, registry: Registry):
+    With `durable` the directory is synced after a data file is created.
+    """
+
+    def __init__(self, registry: Registry, durable: bool = False):
         self._registry = registry
+        self._durable = durable
 
         self._fds: dict[int, typing.BinaryIO] = {}
 
+        # Cached OS-level descriptors of opened files
+        self._filenos: dict[int, int] = {}
+
+        # Read-only memory maps of non-active files
+        self._mms: dict[int, mmap.mmap] = {}
+
         for file_id in registry.sorted_key_ids():
             assert isinstance(file_id, int)
             data_path = registry.data_path(file_id)
-            if os.path.isfile(data_path):
-                # Open non-active files as read-only
+            active = file_id == registry.active_file_id()
+            fd: typing.BinaryIO
+            if not os.path.isfile(data_path):
+                fd = open(data_path, "w+b")
+            elif active:
                 fd = open(data_path, "r+b")
             else:
-                fd = open(data_path, "w+b")
+                # Open non-active files as read-only
+                fd = open(data_path, "rb")
             self._fds[file_id] = fd
+            self._filenos[file_id] = fd.fileno()
+            if not active:
+                self.map(file_id)
 
     def file_obj(self, file_id: int) -> typing.BinaryIO:
         if file_id not in self._fds:
             raise ValueError(f"File {file_id} not opened")
         return self._fds[file_id]
 
+    def pread(self, file_id: int, size: int, pos: int) -> bytes:
+        """Read `size` bytes at offset `pos` without moving the file position"""
+        if hasattr(os, "pread"):
+            return os.pread(self._filenos[file_id], size, pos)
+        # no pread on Windows
+        fd = self.file_obj(file_id)
+        fd.seek(pos)
+        return fd.read(size)
+
+    def advise(self, file_id: int, sequential: bool) -> None:
+        """Hint the OS whether file `file_id` is read sequentially or randomly"""
+        if not hasattr(os, "posix_fadvise"):
+            return
+        advice = os.POSIX_FADV_SEQUENTIAL if sequential else os.POSIX_FADV_RANDOM
+        os.posix_fadvise(self._filenos[file_id], 0, 0, advice)
+
+    def mapping(self, file_id: int) -> mmap.mmap | None:
+        """Return memory map for non-active file `file_id` if it is mapped"""
+        return self._mms.get(file_id)
+
+    def map(self, file_id: int) -> None:
+        """Map immutable file `file_id` to memory for reading"""
+        fd = self.file_obj(file_id)
+        fd.flush()
+        if file_id in self._mms or os.fstat(fd.fileno()).st_size == 0:
+            # empty files cannot be mapped
+            return
+        logger.info(f"Map file {file_id}")
+        mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_RANDOM"):
+            # point lookups do not benefit from read-ahead
+            mm.madvise(mmap.MADV_RANDOM)
+        self._mms[file_id] = mm
+
+    def freeze(self, file_id: int) -> None:
+        """Reopen formerly active file `file_id` as read-only and map it"""
+        logger.info(f"Reopen fd for file {file_id} as read-only")
+        old_fd = self.file_obj(file_id)
+        old_fd.flush()
+        fd = open(self._registry.data_path(file_id), "rb")
+        self._fds[file_id] = fd
+        self._filenos[file_id] = fd.fileno()
+        old_fd.close()
+        self.map(file_id)
+
     def open(self, file_id: int) -> None:
         """Open new file for writing"""
         logger.info(f"Open fd for file {file_id}")
         data_path = self._registry.data_path(file_id)
         fd = open(data_path, "w+b")
+        if self._durable:
+            _sync_dir(os.path.dirname(data_path))
         self._fds[file_id] = fd
+        self._filenos[file_id] = fd.fileno()
 
     def close(self, file_id: int) -> None:
         if file_id not in self._fds:
             return
         logger.info(f"Closing fd for file {file_id}")
+        if file_id in self._mms:
+            self._mms.pop(file_id).close()
         fd = self._fds[file_id]
         fd.flush()
         fd.close()
         del self._fds[file_id]
+        del self._filenos[file_id]
 
 
 class DiskStorage:
@@ -230,100 +402,221 @@ class DiskStorage:
         file_name (str): name of the file where all the data will be written. Just
             passing the file name will save the data in the current directory. You may
             pass the full file location too.
+        max_size (int): size of the active file after which a new file is started,
+            -1 to keep a single file.
+        durability (str): when written data is synced to the disk. With "none"
+            records stay in the in-process write buffer until it fills up, the
+            storage is closed or garbage collected, so a process crash loses them;
+            syncing written data is left to the OS. "batch" also syncs every time
+            the write buffer is flushed, "per_write" flushes and syncs on every
+            write. Both also sync the registry and the directory when files are
+            added.
     """
 
-    def __init__(self, file_name: str = "data.db", max_size: int = -1):
+    def __init__(
+        self,
+        file_name: str = "data.db",
+        max_size: int = -1,
+        durability: Durability = "none",
+    ):
+        if durability not in typing.get_args(Durability):
+            raise ValueError(f"Unknown durability {durability}")
+        self._durability = durability
+
         self._max_size = max_size
 
-        # active file size
+        # active file size, including buffered writes
         self._size = 0
 
+        # Records not yet written to the active file and the file offset they
+        # start at
+        self._wbuf = bytearray()
+        self._wbuf_base_offset = 0
+
         # Registry for storing associations from fileid to filename
-        self._registry = Registry(file_name)
+        durable = durability != "none"
+        self._registry = Registry(file_name, durable)
 
-        self._descriptors = FileDescriptors(self._registry)
+        self._descriptors = FileDescriptors(self._registry, durable)
 
         if self._registry.empty():
             logger.info("Add first file")
             self._registry_add_file()
 
+        # Active file is cached for the write path, updated on rollover
+        self._active_file_id = self._registry.active_file_id()
+        self._active_fd = self._descriptors.file_obj(self._active_file_id)
+
         # Populate key dir
         self._keydir = KeyDir()
-        for file_id in self._registry.sorted_key_ids():
-            self._fill_keydir(file_id)
+        self._fill_keydir()
+
+        self._size = self._registry.segment_size(self._active_file_id)
+        self._wbuf_base_offset = self._size
 
     def _registry_add_file(self) -> None:
+        self._flush()
+
+        prev_file_id = (
+            None if self._registry.empty() else self._registry.active_file_id()
+        )
+
         file_id = self._registry.add_file()
 
         # it is a new file
         self._descriptors.open(file_id)
 
+        # previous active file is immutable from now on
+        if prev_file_id is not None:
+            self._descriptors.freeze(prev_file_id)
+
+        self._active_file_id = file_id
+        self._active_fd = self._descriptors.file_obj(file_id)
         self._size = 0
+        self._wbuf_base_offset = 0
 
         self._registry.save()
 
-    def _fill_keydir(self, file_id: int) -> None:
+    def _scan_file(
+        self, file_id: int, consume: typing.Callable[[int, memoryview], int]
+    ) -> None:
+        """Read file `file_id` sequentially in large chunks.
+
+        `consume` gets the file offset of a buffer and the buffer, and returns the
+        size of complete records it has processed. The rest of the buffer is a
+        partial record which is carried over to the next chunk.
+        """
         fd = self._descriptors.file_obj(file_id)
+        file_size = os.fstat(fd.fileno()).st_size
+        self._descriptors.advise(file_id, sequential=True)
+
+        # file offset of the beginning of buf
+        base = 0
+        buf = memoryview(b"")
+        while base + len(buf) < file_size:
+            chunk = self._descriptors.pread(file_id, READ_CHUNK_SIZE, base + len(buf))
+            if not chunk:
+                break
+            buf = memoryview(bytes(buf) + chunk) if buf else memoryview(chunk)
 
-        # Determine size
-        fd.seek(0, 2)
-        self._size = fd.tell()
-
-        logger.info(f"Fill keydir initially size={self._size}")
-        pos = 0
-        while pos < self._size:
-            # Read header
-            fd.seek(pos + 4)
-            header = fd.read(HEADER_SIZE)
-            timestamp, key_size, value_size = decode_header(header)
-            logger.debug(
-                f"From {pos=} read header {timestamp=} {key_size=} {value_size=}"
-            )
+            pos = consume(base, buf)
+            base += pos
+            buf = buf[pos:]
 
-            # Re-read whole entry
-            fd.seek(pos)
-            read_size = 4 + HEADER_SIZE + key_size + value_size
-            data = fd.read(read_size)
-            logger.debug(f"From {pos=} read data {read_size=}")
+        # the file is accessed by point lookups from now on
+        self._descriptors.advise(file_id, sequential=False)
 
-            timestamp, key, _ = decode_kv(data)
+        if base != file_size:
+            raise ValueError(f"File {file_id} is truncated at {base}")
 
-            entry = KeyDirEntry(
-                pos=pos, size=key_size + value_size, tstamp=timestamp, file_id=file_id
-            )
-            self._keydir.set(key, entry)
+    def _parse_file(
+        self, file_id: int, deleted: typing.Container[str]
+    ) -> dict[str, KeyDirEntry | None]:
+        """Collect latest entries of keys in file `file_id` not set by newer files.
+
+        Keys already in keydir or in `deleted` were written by newer files and are
+        skipped. Keys deleted by the latest record are mapped to None.
+        """
+        logger.info(f"Parse file {file_id}")
 
-            logger.debug(f"init keydir key={key} entry={entry}")
+        # local names are faster to look up in the loop
+        _intern = sys.intern
+        keydir = self._keydir
 
-            pos += read_size
+        found: dict[str, KeyDirEntry | None] = {}
 
-        assert pos == self._size
+        def consume(base: int, buf: memoryview) -> int:
+            # whole chunk is decoded in one call
+            keys, positions, sizes, timestamps, tombstones, decoded = decode_records(
+                buf
+            )
+            for key, pos, size, timestamp, tombstone in zip(
+                keys, positions, sizes, timestamps, tombstones
+            ):
+                if key in keydir or key in deleted:
+                    continue
+                # keys repeat across files
+                found[_intern(key)] = (
+                    None if tombstone else (file_id, size, base + pos, timestamp)
+                )
+            return decoded
+
+        self._scan_file(file_id, consume)
+        return found
+
+    def _fill_keydir(self) -> None:
+        """Fill keydir from all files.
+
+        Files are parsed starting from the newest one and merged as soon as they
+        are parsed, so keys from older files do not overwrite newer ones.
+        """
+        keydir = self._keydir
+        # keys deleted in newer files
+        deleted: set[str] = set()
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for file_id in reversed(list(self._registry.sorted_key_ids())):
+            found = self._parse_file(file_id, deleted)
+            for key, entry in found.items():
+                if entry is None:
+                    deleted.add(key)
+                    continue
+                keydir.set(key, *entry)
+                if debug:
+                    logger.debug(f"init keydir key={key} entry={entry}")
 
     def _timestamp(self) -> int:
-        return round(datetime.datetime.utcnow().timestamp())
+        return int(time.time())
 
-    def set(self, key: str, value: str) -> None:
-        fd = self._descriptors.file_obj(self._registry.active_file_id())
+    def _flush(self) -> None:
+        """Write buffered records to the active file"""
+        if not self._wbuf:
+            return
+        fd = self._active_fd
+        logger.debug(f"flush {len(self._wbuf)} bytes at {self._wbuf_base_offset}")
+        fd.seek(self._wbuf_base_offset)
+        fd.write(self._wbuf)
+        # make the records visible to pread
+        fd.flush()
+        if self._durability != "none":
+            _sync(fd)
+        self._wbuf_base_offset += len(self._wbuf)
+        self._wbuf.clear()
 
+    def set(self, key: str, value: str) -> None:
         timestamp = self._timestamp()
-        size, data = encode_kv(timestamp, key, value)
-
-        offset = fd.seek(self._size)
-        logger.debug(f"seek to {offset}")
-        # logger.debug(f"write size {size+4} bytes, data {data.hex()}")
-        fd.write(data)
-        write_size = 4 + HEADER_SIZE + size
-        self._size += write_size
-
-        entry = KeyDirEntry(
-            pos=offset,
-            size=size,
-            tstamp=timestamp,
-            file_id=self._registry.active_file_id(),
-        )
-        self._keydir.set(key, entry)
+        # encode straight into the write buffer
+        record_size = encode_kv_into(self._wbuf, timestamp, key, value)
+        self._add_record(key, record_size, timestamp)
+
+    def _append(
+        self,
+        key: str,
+        data: bytes | memoryview,
+        timestamp: int,
+        tombstone: bool = False,
+    ) -> None:
+        """Append encoded record for `key` to the active file"""
+        # logger.debug(f"write size {len(data)} bytes, data {data.hex()}")
+        self._wbuf += data
+        self._add_record(key, len(data), timestamp, tombstone)
+
+    def _add_record(
+        self, key: str, record_size: int, timestamp: int, tombstone: bool = False
+    ) -> None:
+        """Account for record of `key` just added to the write buffer"""
+        offset = self._size
+        self._size += record_size
+
+        if tombstone:
+            self._keydir.delete(key)
+            logger.debug(f"delete keydir key={key}, size so far {self._size}")
+        else:
+            size = record_size - 4 - HEADER_SIZE
+            self._keydir.set(key, self._active_file_id, size, offset, timestamp)
+            logger.debug(f"set keydir key={key} pos={offset}, size so far {self._size}")
 
-        logger.debug(f"set keydir key={key} entry={entry}, size so far {self._size}")
+        if len(self._wbuf) >= WRITE_BUFFER_SIZE or self._durability == "per_write":
+            self._flush()
 
         if self._max_size != -1 and self._size > self._max_size:
             self.split()
@@ -332,6 +625,20 @@ class DiskStorage:
         """Activate new file and move current active to non-active."""
         self._registry_add_file()
 
+    def _copy_live(self, file_id: int, live: typing.Container[tuple[int, int]]) -> None:
+        """Append records of file `file_id` with locations in `live` to active file"""
+
+        def consume(base: int, buf: memoryview) -> int:
+            keys, positions, sizes, timestamps, _, decoded = decode_records(buf)
+            # tombstones are never live, so they are dropped
+            for key, pos, size, timestamp in zip(keys, positions, sizes, timestamps):
+                if (file_id, base + pos) in live:
+                    record = buf[pos : pos + 4 + HEADER_SIZE + size]
+                    self._append(key, record, timestamp)
+            return decoded
+
+        self._scan_file(file_id, consume)
+
     def compact(self) -> None:
         """Compact all exisiting files to new active file."""
 
@@ -341,10 +648,12 @@ class DiskStorage:
         # Add new file
         self._registry_add_file()
 
-        # Iterate over all keys
-        for key in self._keydir.keys():
-            value = self.get(key)
-            self.set(key, value)
+        # Locations of records referenced by keydir
+        live = {(file_id, pos) for _, (file_id, _, pos, _) in self._keydir.items()}
+
+        # Scan all files sequentially and copy live records as is
+        for file_id in sorted_file_ids:
+            self._copy_live(file_id, live)
 
         # Close and remove all previous files
         for file_id in sorted_file_ids:
@@ -358,26 +667,48 @@ class DiskStorage:
         entry = self._keydir.get(key)
         if entry is None:
             return ""
-
-        fd = self._descriptors.file_obj(entry.file_id)
-        logger.debug(f"get seek to {entry.pos} with size {entry.size}")
-        fd.seek(entry.pos)
-        read_size = 4 + HEADER_SIZE + entry.size
-        data = fd.read(read_size)
-        # logger.debug(f"read size {entry.size+4} bytes, data {data.hex()}")
+        file_id, size, pos, _ = entry
+
+        read_size = 4 + HEADER_SIZE + size
+        mm = self._descriptors.mapping(file_id)
+        if mm is not None:
+            data = mm[pos : pos + read_size]
+        elif file_id == self._active_file_id and pos >= self._wbuf_base_offset:
+            start = pos - self._wbuf_base_offset
+            data = bytes(self._wbuf[start : start + read_size])
+        else:
+            logger.debug(f"get read at {pos} with size {size}")
+            data = self._descriptors.pread(file_id, read_size, pos)
+        # logger.debug(f"read size {size+4} bytes, data {data.hex()}")
         timestamp, read_key, read_value = decode_kv(data)
         if key != read_key:
             raise ValueError(f"Different keys: keydir {key}, disk {read_key}")
         return read_value
 
     def delete(self, key: str) -> None:
-        self.set(key, "")
-        self._keydir.delete(key)
+        if key not in self._keydir:
+            return
+        timestamp = self._timestamp()
+        self._append(key, encode_tombstone(timestamp, key), timestamp, tombstone=True)
 
     def close(self) -> None:
+        self._flush()
         for file_id in self._registry.sorted_key_ids():
             self._descriptors.close(file_id)
 
+    def __enter__(self) -> "DiskStorage":
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        # Records still in the write buffer must reach the file even if the
+        # storage is not closed, as unbuffered writes did
+        active_fd = getattr(self, "_active_fd", None)
+        if active_fd is not None and self._wbuf and not active_fd.closed:
+            self._flush()
+
     def clean(self) -> None:
         for file_id in self._registry.sorted_key_ids():
             data_path = self._registry.data_path(file_id)
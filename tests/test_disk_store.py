@@ -7,11 +7,18 @@ import sys
 import tempfile
 import typing
 import unittest
+from unittest import mock
 
 from hypothesis import given, settings, strategies as st
 
 from disk_store import DiskStorage
 
+# Keep test databases in memory when a tmpfs is mounted, the storage needs real
+# file descriptors for mmap, pread and fsync so files cannot be faked
+SHM_DIR: typing.Optional[str] = (
+    "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+)
+
 
 class TempStorageFile:
     """
@@ -27,7 +34,8 @@ class TempStorageFile:
 
     Args:
         path (str): path to the file where our data needs to be stored. If the path
-            parameter is empty, then a temporary will be created using tempfile API
+            parameter is empty, then a temporary will be created using tempfile API,
+            in /dev/shm if available
     """
 
     def __init__(self, path: typing.Optional[str] = None):
@@ -36,7 +44,7 @@ class TempStorageFile:
             self.dirpath = None
             return
 
-        self.dirpath = tempfile.mkdtemp(prefix="pycaskdb")
+        self.dirpath = tempfile.mkdtemp(prefix="pycaskdb", dir=SHM_DIR)
         self.path = self.dirpath + "/main.db"
 
     def clean_up(self) -> None:
@@ -126,6 +134,29 @@ class TestDiskCDB(unittest.TestCase):
         self.assertEqual(store["foo"], "fooval")
         store.close()
 
+    def test_dict_delete_compaction(self) -> None:
+        store = DiskStorage(file_name=self.file.path, max_size=60)
+        store["name"] = "jojo"
+        store["foo"] = "fooval"
+        store["bar"] = "barval"
+        store.delete("name")
+        store.delete("missing")
+        store.close()
+
+        # deleted key stays deleted and is not scanned
+        store = DiskStorage(file_name=self.file.path, max_size=60)
+        self.assertEqual(store["name"], "")
+        self.assertEqual(list(sorted(store.scan("a", "z"))), ["bar", "foo"])
+
+        # compaction drops deleted keys
+        store.compact()
+        store.close()
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store["name"], "")
+        self.assertEqual(store["foo"], "fooval")
+        self.assertEqual(list(sorted(store.scan("a", "z"))), ["bar", "foo"])
+        store.close()
+
     def test_range(self) -> None:
         store = DiskStorage(file_name=self.file.path)
 
@@ -148,6 +179,12 @@ class TestDiskCDB(unittest.TestCase):
         scanned = list(sorted(list(store.scan("brave", "aelita"))))
         assert scanned == []
 
+        # scans reflect added and deleted keys
+        store.set("catch-22", "heller")
+        store.delete("dune")
+        scanned = list(sorted(list(store.scan("brave", "hackers"))))
+        assert scanned == ["brave new world", "catch-22", "crime and punishment"]
+
     @given(st.lists(st.text(min_size=1, max_size=10), min_size=1, max_size=100))
     def test_multi(self, keys: typing.List[str]) -> None:
         store = DiskStorage(file_name=self.file.path)
@@ -182,8 +219,8 @@ class TestDiskCDB(unittest.TestCase):
         store.close()
 
         with open(self.file.path, "rt") as f:
-            jregistry = json.load(f)
-            assert len(jregistry) == 2
+            registry = f.read().splitlines()
+            assert registry == ["0\tdata_00.bin", "1\tdata_01.bin"]
         for file_id in range(2):
             data_path = os.path.join(
                 os.path.dirname(self.file.path), f"data_0{file_id}.bin"
@@ -219,6 +256,20 @@ class TestDiskCDB(unittest.TestCase):
                 self.assertEqual(store.get(k), v)
         store.close()
 
+    def test_two_overwrite_reopen(self) -> None:
+        store = DiskStorage(file_name=self.file.path, max_size=60)
+        for i in range(7):
+            store.set("name", f"v{i}")
+            store.set(f"k{i}", f"v{i}")
+        store.close()
+
+        # newest file wins
+        store = DiskStorage(file_name=self.file.path, max_size=60)
+        self.assertEqual(store.get("name"), "v6")
+        for i in range(7):
+            self.assertEqual(store.get(f"k{i}"), f"v{i}")
+        store.close()
+
     def test_compaction(self) -> None:
         store = DiskStorage(file_name=self.file.path, max_size=60)
 
@@ -306,3 +357,108 @@ class TestDiskCDBExistingFile(unittest.TestCase):
         store = DiskStorage(file_name=self.file.path)
         self.assertEqual(store.get("name"), "jojo")
         store.close()
+
+    def test_write_buffer(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        data_path = os.path.join(os.path.dirname(self.file.path), "data_00.bin")
+        store.set("name", "jojo")
+        # record is kept in memory until closed
+        self.assertEqual(os.path.getsize(data_path), 0)
+        self.assertEqual(store.get("name"), "jojo")
+        store.close()
+        self.assertGreater(os.path.getsize(data_path), 0)
+
+        store = DiskStorage(file_name=self.file.path)
+        size = os.path.getsize(data_path)
+        with mock.patch("disk_store.WRITE_BUFFER_SIZE", 1):
+            store.set("foo", "fooval")
+            # buffer is flushed when full
+            self.assertGreater(os.path.getsize(data_path), size)
+            self.assertEqual(store.get("foo"), "fooval")
+            store.set("name", "new")
+        self.assertEqual(store.get("foo"), "fooval")
+        self.assertEqual(store.get("name"), "new")
+        store.close()
+
+    def test_reopen_without_close(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        store.set("name", "jojo")
+        # buffered record is flushed when the storage is garbage collected
+        del store
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store.get("name"), "jojo")
+        store.close()
+
+        with DiskStorage(file_name=self.file.path) as store:
+            store.set("foo", "fooval")
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store.get("foo"), "fooval")
+        store.close()
+
+    def test_durability(self) -> None:
+        data_path = os.path.join(os.path.dirname(self.file.path), "data_00.bin")
+        with self.assertRaises(ValueError):
+            DiskStorage(file_name=self.file.path, durability="always")  # type: ignore
+
+        store = DiskStorage(file_name=self.file.path, durability="per_write")
+        store.set("name", "jojo")
+        self.assertGreater(os.path.getsize(data_path), 0)
+        self.assertEqual(store.get("name"), "jojo")
+        store.close()
+
+        store = DiskStorage(file_name=self.file.path, durability="batch")
+        self.assertEqual(store.get("name"), "jojo")
+        store.set("name", "new")
+        store.close()
+
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store.get("name"), "new")
+        store.close()
+
+    def test_durability_rollover(self) -> None:
+        store = DiskStorage(
+            file_name=self.file.path, max_size=60, durability="per_write"
+        )
+        for i in range(7):
+            store.set(f"k{i}", f"v{i}")
+        store.close()
+
+        # registry is replaced, not left next to a temporary copy
+        self.assertEqual(
+            sorted(os.listdir(os.path.dirname(self.file.path))),
+            ["data_00.bin", "data_01.bin", "main.db"],
+        )
+
+        store = DiskStorage(
+            file_name=self.file.path, max_size=60, durability="per_write"
+        )
+        for i in range(7):
+            self.assertEqual(store.get(f"k{i}"), f"v{i}")
+        store.close()
+
+    def test_json_registry(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        store.set("name", "jojo")
+        store.close()
+
+        # registry written by older versions
+        with open(self.file.path, "wt") as f:
+            json.dump({"0": "data_00.bin"}, f, indent=True)
+
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store.get("name"), "jojo")
+        store.close()
+
+    def test_small_read_chunks(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        keys = [f"key{idx}" for idx in range(20)]
+        for k in keys:
+            store.set(k, f"value of {k}")
+        store.close()
+
+        # records span over chunk boundaries
+        with mock.patch("disk_store.READ_CHUNK_SIZE", 7):
+            store = DiskStorage(file_name=self.file.path)
+        for k in keys:
+            self.assertEqual(store.get(k), f"value of {k}")
+        store.close()
@@ -4,8 +4,20 @@ import time
 import typing
 import unittest
 import uuid
-
-from format import encode_header, decode_header, encode_kv, decode_kv
+from unittest import mock
+
+from format import (
+    encode_header,
+    decode_header,
+    encode_kv,
+    encode_kv_batch,
+    encode_kv_bytes,
+    encode_kv_into,
+    encode_tombstone,
+    decode_kv,
+    decode_kv_bytes,
+    decode_records,
+)
 
 # TODO: use correct value
 HEADER_SIZE: typing.Final[int] = 0
@@ -71,6 +83,7 @@ class TestHeaderOp(unittest.TestCase):
     def test_bad(self) -> None:
         # trying to encode an int with size more than 4 bytes should raise an error
         self.assertRaises(struct.error, encode_header, 2**32, 5, 5)
+        self.assertRaises(struct.error, encode_header, 10, -1, 5)
 
 
 class TestEncodeKV(unittest.TestCase):
@@ -86,6 +99,7 @@ class TestEncodeKV(unittest.TestCase):
         tests: typing.List[KeyValue] = [
             KeyValue(10, "hello", "world", HEADER_SIZE + 10),
             KeyValue(0, "", "", HEADER_SIZE),
+            KeyValue(10, "large", "v" * 65536, HEADER_SIZE + 65541),
         ]
         for tt in tests:
             self.kv_test(tt)
@@ -94,3 +108,83 @@ class TestEncodeKV(unittest.TestCase):
         for _ in range(100):
             tt = KeyValue(*get_random_kv())
             self.kv_test(tt)
+
+    def test_bytes(self) -> None:
+        sz, data = encode_kv_bytes(10, "ключ".encode(), b"world")
+        self.assertEqual(sz, 8 + 5)
+        self.assertEqual(data, encode_kv(10, "ключ", "world")[1])
+        self.assertEqual(decode_kv_bytes(data), (10, "ключ".encode(), b"world"))
+
+    def test_encode_into(self) -> None:
+        buf = bytearray(b"prefix")
+        for tt in [
+            KeyValue(10, "hello", "world", 0),
+            KeyValue(*get_random_kv()),
+            KeyValue(10, "large", "v" * 100, 0),
+        ]:
+            start = len(buf)
+            appended = encode_kv_into(buf, tt.timestamp, tt.key, tt.val)
+            _, data = encode_kv(tt.timestamp, tt.key, tt.val)
+            self.assertEqual(appended, len(data))
+            self.assertEqual(bytes(buf[start:]), data)
+        self.assertEqual(buf[:6], b"prefix")
+
+        # failed encoding leaves buffer intact
+        size = len(buf)
+        for value in ["world", "v" * 100]:
+            self.assertRaises(struct.error, encode_kv_into, buf, 2**32, "hello", value)
+            self.assertEqual(len(buf), size)
+
+    def test_encode_tombstone_size(self) -> None:
+        # values of TOMBSTONE bytes or more would read back as tombstones
+        with mock.patch("format.TOMBSTONE", 5):
+            buf = bytearray()
+            self.assertRaises(ValueError, encode_kv_into, buf, 10, "hello", "world")
+            self.assertEqual(buf, b"")
+            self.assertRaises(ValueError, encode_kv_bytes, 10, b"hello", b"world")
+            encode_kv_into(buf, 10, "hello", "worl")
+            self.assertGreater(len(buf), 0)
+
+    def test_encode_batch(self) -> None:
+        tests = [KeyValue(10, "hello", "world", 0), KeyValue(*get_random_kv())]
+        data = encode_kv_batch((tt.timestamp, tt.key, tt.val) for tt in tests)
+        self.assertEqual(
+            data, b"".join(encode_kv(tt.timestamp, tt.key, tt.val)[1] for tt in tests)
+        )
+        self.assertEqual(encode_kv_batch([]), b"")
+
+    def test_decode_records(self) -> None:
+        tests = [KeyValue(10, "hello", "world", 0), KeyValue(*get_random_kv())]
+        buf = bytearray()
+        for tt in tests:
+            encode_kv_into(buf, tt.timestamp, tt.key, tt.val)
+
+        keys, positions, sizes, timestamps, tombstones, decoded = decode_records(
+            bytes(buf)
+        )
+        self.assertEqual(keys, [tt.key for tt in tests])
+        self.assertEqual(positions, [0, 4 + 12 + 10])
+        self.assertEqual(sizes, [len(tt.key) + len(tt.val) for tt in tests])
+        self.assertEqual(timestamps, [tt.timestamp for tt in tests])
+        self.assertEqual(tombstones, [False, False])
+        self.assertEqual(decoded, len(buf))
+
+        # partial record is left
+        keys, _, _, _, _, decoded = decode_records(bytes(buf[:-1]))
+        self.assertEqual(keys, ["hello"])
+        self.assertEqual(decoded, positions[1])
+
+        buf[-1] ^= 0xFF
+        self.assertRaises(ValueError, decode_records, bytes(buf))
+
+    def test_tombstone(self) -> None:
+        data = encode_tombstone(10, "hello")
+        self.assertEqual(len(data), 4 + 12 + 5)
+        self.assertEqual(decode_kv(data), (10, "hello", ""))
+
+        keys, _, sizes, timestamps, tombstones, decoded = decode_records(data)
+        self.assertEqual(keys, ["hello"])
+        self.assertEqual(sizes, [5])
+        self.assertEqual(timestamps, [10])
+        self.assertEqual(tombstones, [True])
+        self.assertEqual(decoded, len(data))